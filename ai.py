@@ -2,26 +2,49 @@
 import os
 import sys
 import json
-import platform
-import subprocess
-import tty
-import termios
-import urllib.request
-import urllib.parse
-import urllib.error
+import atexit
 from pathlib import Path
 
+OS_PROMPTS = {
+    'macos': "Convert the following request into a macOS terminal command. Use macOS-compatible syntax (avoid bash-specific features like ${var,,} for lowercase conversion). ",
+    'windows': "Convert the following request into a Windows CMD or PowerShell command.",
+    'linux': "Convert the following request into a Linux shell command."
+}
+GENERAL_PROMPT = "Return only the command to be executed, nothing else, no markdown, formatting or prose. Only add the lolcat command if something colorful, fun or lolcat directly is requested. If so, add the -f option to lolcat."
+JSON_ENCODE = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+JSON_DECODE = json.JSONDecoder().decode
+CLEAR_LINE = b'\r\033[K'
+CURSOR_LEFT = b'\b'
+CURSOR_RIGHT = b'\033[C'
+DELETE_CHAR = b'\033[P'  # Delete character under cursor
+RESPONSE_CACHE_TTL = 24 * 60 * 60
+MAX_PROMPT_LENGTH = 2000
+
 class AI:
     def __init__(self):
         self.config_path = Path.home() / '.cmdline-ai-helper'
+        self.cache_dir = Path.home() / '.cache' / 'cmdline-ai-helper'
+        self._conns = {}
+        self.use_cache = True
+        self._pending = b''
+        atexit.register(self.close_connections)
         self.detect_os()
+        self._prompt_prefix = f"{OS_PROMPTS[self.os_type]} {GENERAL_PROMPT} Request: "
         self.load_config()
+        self.provider = self.config['DEFAULT_PROVIDER']
+        self._providers = {
+            'openai': self.call_openai,
+            'anthropic': self.call_anthropic,
+            'google': self.call_google,
+            'ollama': self.call_ollama
+        }
+        self.use_http2 = self.config.get('HTTP2', '').lower() in ('1', 'true', 'yes')
+        self._http2_client = None
 
     def detect_os(self):
-        system = platform.system()
-        if system == 'Darwin':
+        if sys.platform == 'darwin':
             self.os_type = 'macos'
-        elif system == 'Windows':
+        elif sys.platform == 'win32':
             self.os_type = 'windows'
         else:
             self.os_type = 'linux'
@@ -33,51 +56,172 @@ class AI:
                 "Please copy .cmdline-ai-helper.sample to ~/.cmdline-ai-helper and edit it"
             )
 
-        self.config = {}
+        # Reuse the parsed config as long as the config file is unchanged
+        stat = os.stat(self.config_path)
+        stamp = [stat.st_mtime_ns, stat.st_size]
+        cache_path = self.cache_dir / 'config.json'
+        try:
+            mtime_ns, size, config = JSON_DECODE(cache_path.read_text(encoding='utf-8'))
+            if [mtime_ns, size] == stamp and isinstance(config, dict):
+                self.config = config
+                return
+        except (OSError, ValueError, TypeError):
+            pass
+
         required_keys = {'DEFAULT_PROVIDER', 'DEFAULT_MODEL'}
 
-        with open(self.config_path) as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    try:
-                        key, value = line.split('=', 1)
-                        self.config[key.strip()] = value.strip()
-                    except ValueError:
-                        print(f"Warning: Ignoring invalid config line: {line}")
+        import re
+        text = self.config_path.read_text()
+        self.config = {}
+        # KEY=VALUE lines, or any other non-comment line without '=' to warn about
+        for key, value, invalid in re.findall(r'^[ \t]*(?:([^#=\s][^=\n]*?)[ \t]*=[ \t]*(.*?)|([^#\s][^=\n]*?))[ \t\r]*$', text, re.M):
+            if key:
+                self.config[key] = value
+            else:
+                print(f"Warning: Ignoring invalid config line: {invalid}")
 
         missing_keys = required_keys - self.config.keys()
         if missing_keys:
             raise ValueError(f"Missing required config keys: {missing_keys}")
 
+        self.write_cache(cache_path, JSON_ENCODE(stamp + [self.config]).encode('utf-8'))
+
+    def write_cache(self, path, data):
+        try:
+            # The cached config holds API keys, keep it private to the user
+            self.cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+            os.chmod(self.cache_dir, 0o700)
+            tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def get_connection(self, scheme, host, port):
+        import http.client
+        key = (scheme, host, port)
+        conn = self._conns.get(key)
+        if conn is None:
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(host, port, timeout=60)
+            else:
+                conn = http.client.HTTPConnection(host, port, timeout=60)
+            self._conns[key] = conn
+        return conn
+
+    def get_http2_client(self):
+        if self._http2_client is None and self.use_http2:
+            try:
+                import httpx
+                self._http2_client = httpx.Client(
+                    http2=True,
+                    timeout=60,
+                    limits=httpx.Limits(max_keepalive_connections=20)
+                )
+            except ImportError:
+                # httpx or h2 not installed, use http.client instead
+                self.use_http2 = False
+        return self._http2_client
+
+    def close_connections(self):
+        for conn in self._conns.values():
+            conn.close()
+        self._conns.clear()
+        if self._http2_client is not None:
+            self._http2_client.close()
+            self._http2_client = None
+
+    def send_request(self, url, headers, data):
+        import http.client
+        import urllib.parse
+        import urllib.request
+        data = JSON_ENCODE(data).encode('utf-8')
+        parts = urllib.parse.urlsplit(url)
+
+        # http.client ignores proxy settings, let urllib handle proxied requests
+        proxies = urllib.request.getproxies()
+        if parts.scheme in proxies and not urllib.request.proxy_bypass(parts.hostname):
+            return self.send_proxied_request(url, headers, data)
+
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(headers, Connection='keep-alive')
+        conn = self.get_connection(parts.scheme, parts.hostname, parts.port)
+
+        # Retry once if the server dropped an idle keep-alive socket
+        for attempt in range(2):
+            try:
+                conn.request('POST', path, body=data, headers=headers)
+                response = conn.getresponse()
+                break
+            except (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError) as e:
+                conn.close()
+                if attempt:
+                    raise RuntimeError(f"Request failed: {e}") from e
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                raise RuntimeError(f"Request failed: {e}") from e
+
+        if response.status >= 400:
+            raise RuntimeError(f"API request failed: {response.read().decode('utf-8')}")
+        return response
+
+    def send_http2_request(self, client, url, headers, data):
+        import httpx
+        try:
+            response = client.post(url, content=JSON_ENCODE(data).encode('utf-8'), headers=headers)
+        except httpx.HTTPError as e:
+            raise RuntimeError(f"Request failed: {e}") from e
+        if response.status_code >= 400:
+            raise RuntimeError(f"API request failed: {response.text}")
+        return response.content
+
+    def send_proxied_request(self, url, headers, data):
+        import urllib.error
+        import urllib.request
+        req = urllib.request.Request(url, data=data, headers=headers, method='POST')
+        try:
+            return urllib.request.urlopen(req, timeout=60)
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"API request failed: {e.read().decode('utf-8')}") from e
+        except urllib.error.URLError as e:
+            raise RuntimeError(f"Request failed: {e.reason}") from e
+
     def make_request(self, url, headers, data):
+        import http.client
+        client = self.get_http2_client()
+        if client is not None:
+            body = self.send_http2_request(client, url, headers, data)
+        else:
+            response = self.send_request(url, headers, data)
+            try:
+                body = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                self.close_connections()
+                raise RuntimeError(f"Failed to read API response: {e}") from e
         try:
-            data = json.dumps(data).encode('utf-8')
-            req = urllib.request.Request(
-                url,
-                data=data,
-                headers=headers,
-                method='POST'
-            )
+            return JSON_DECODE(body.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise RuntimeError("Failed to parse API response") from e
+
+    def post_streaming(self, url, headers, data):
+        import http.client
+        with self.send_request(url, headers, data) as response:
             try:
-                with urllib.request.urlopen(req) as response:
-                    return json.loads(response.read().decode('utf-8'))
-            except urllib.error.HTTPError as e:
-                error_message = e.read().decode('utf-8')
-                raise Exception(f"API request failed: {error_message}")
-            except json.JSONDecodeError:
-                raise Exception("Failed to parse API response")
-        except Exception as e:
-            raise Exception(f"Request failed: {str(e)}")
+                for line in iter(response.readline, b''):
+                    if line.strip():
+                        yield JSON_DECODE(line.decode('utf-8'))
+            except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                raise RuntimeError(f"Failed to parse streamed response: {e}") from e
+            except (OSError, http.client.HTTPException) as e:
+                self.close_connections()
+                raise RuntimeError(f"Failed to read streamed response: {e}") from e
 
     def get_prompt(self, user_input):
-        os_prompts = {
-            'macos': "Convert the following request into a macOS terminal command. Use macOS-compatible syntax (avoid bash-specific features like ${var,,} for lowercase conversion). ",
-            'windows': "Convert the following request into a Windows CMD or PowerShell command.",
-            'linux': "Convert the following request into a Linux shell command."
-        }
-        general_prompt = "Return only the command to be executed, nothing else, no markdown, formatting or prose. Only add the lolcat command if something colorful, fun or lolcat directly is requested. If so, add the -f option to lolcat."
-        return f"{os_prompts[self.os_type]} {general_prompt} Request: {user_input}"
+        return self._prompt_prefix + user_input
 
     def call_google(self, prompt):
         url = f"{self.config['GOOGLE_ENDPOINT']}?key={self.config['GOOGLE_API_KEY']}"
@@ -127,49 +271,98 @@ class AI:
             'model': self.config['DEFAULT_MODEL'],
             'prompt': prompt
         }
-        response = self.make_request(self.config['OLLAMA_ENDPOINT'], headers, data)
-        if isinstance(response, str):
-            return response.strip().strip('`')
-
         full_response = ''
-        try:
-            if isinstance(response, dict) and 'response' in response:
-                return response['response'].strip().strip('`')
-            for line in response.get('text', '').strip().split('\n'):
-                if line:
-                    json_obj = json.loads(line)
-                    if 'response' in json_obj:
-                        full_response += json_obj['response']
-            return full_response.strip().strip('`')
-        except (json.JSONDecodeError, AttributeError) as e:
-            raise Exception(f"Failed to parse Ollama response: {e}")
+        for json_obj in self.post_streaming(self.config['OLLAMA_ENDPOINT'], headers, data):
+            if 'error' in json_obj:
+                raise RuntimeError(f"Ollama request failed: {json_obj['error']}")
+            full_response += json_obj.get('response', '')
+        return full_response.strip().strip('`')
 
     def call_llm(self, prompt):
-        provider = self.config['DEFAULT_PROVIDER']
-        if provider == 'openai':
-            return self.call_openai(prompt)
-        elif provider == 'anthropic':
-            return self.call_anthropic(prompt)
-        elif provider == 'google':
-            return self.call_google(prompt)
-        elif provider == 'ollama':
-            return self.call_ollama(prompt)
-        else:
-            raise Exception(f"Unknown provider: {provider}")
+        try:
+            call = self._providers[self.provider]
+        except KeyError:
+            raise Exception(f"Unknown provider: {self.provider}")
 
-    def get_char(self):
-        fd = sys.stdin.fileno()
-        old_settings = termios.tcgetattr(fd)
+        import hashlib
+        import time
+        key = f"{self.provider}|{self.config['DEFAULT_MODEL']}|{prompt}"
+        cache_path = self.cache_dir / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.txt"
+        if self.use_cache:
+            try:
+                if time.time() - cache_path.stat().st_mtime < RESPONSE_CACHE_TTL:
+                    return cache_path.read_text(encoding='utf-8')
+            except OSError:
+                pass
+
+        response = call(prompt)
+        if response.strip():
+            self.write_cache(cache_path, response.encode('utf-8'))
+        self.prune_response_cache(time.time())
+        return response
+
+    def prune_response_cache(self, now):
+        # Runs after a network request anyway, so the directory scan is cheap in comparison
         try:
-            tty.setraw(fd)
-            ch = sys.stdin.read(1)
-        finally:
-            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-        return ch
+            with os.scandir(self.cache_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.txt') and now - entry.stat().st_mtime >= RESPONSE_CACHE_TTL:
+                        os.unlink(entry.path)
+        except OSError:
+            pass
+
+    def read_key(self, fd):
+        # Reads can hold several keys (fast typing, paste), return one key per call
+        buf = self._pending
+        while True:
+            if not buf:
+                buf = os.read(fd, 64)
+                if not buf:
+                    raise EOFError("Input closed")
+
+            if buf[0] < 0x80 and buf[0] != 0x1b:  # Plain ASCII, the common case
+                size = 1
+            elif buf == b'\x1b':  # ESC, or the start of a sequence split across reads
+                import select
+                size = 0 if select.select([fd], [], [], 0.05)[0] else 1
+            elif buf.startswith(b'\x1b['):  # Escape sequence up to its final byte
+                size = next((i + 1 for i in range(2, len(buf)) if 0x40 <= buf[i] <= 0x7e), 0)
+            elif buf[0] < 0x80:  # ESC followed by another key
+                size = 1
+            elif buf[0] < 0xc0 or buf[0] >= 0xf8:  # Invalid lead byte, drop it on its own
+                size = 1
+            else:  # Multibyte UTF-8 character, length from the lead byte
+                size = 2 if buf[0] < 0xe0 else 3 if buf[0] < 0xf0 else 4
+                if len(buf) < size:
+                    size = 0
+                else:
+                    try:
+                        buf[:size].decode('utf-8')
+                    except UnicodeDecodeError:
+                        size = 1
+
+            if size:
+                break
+            more = os.read(fd, 8)
+            if not more:
+                size = len(buf)
+                break
+            buf += more
+
+        self._pending = buf[size:]
+        return buf[:size]
 
     def run(self, args):
+        import tty
+        import termios
         # Join args with spaces and escape special characters
-        prompt = ' '.join(args)
+        prompt = ' '.join(args).strip()
+        if not prompt:
+            print("Error: Empty prompt")
+            return 1
+        if len(prompt) > MAX_PROMPT_LENGTH:
+            print(f"Error: Prompt too long ({len(prompt)} characters, max {MAX_PROMPT_LENGTH})")
+            return 1
         command = self.call_llm(self.get_prompt(prompt))
 
         print("\nEdit command and press Enter to execute, or ESC to cancel:\n")
@@ -179,55 +372,77 @@ class AI:
         # Enable raw mode
         fd = sys.stdin.fileno()
         old_settings = termios.tcgetattr(fd)
+        cancelled = False
         try:
+            tty.setraw(fd)
+            sys.stdout.flush()
+            out_fd = sys.stdout.fileno()
+            out = b''
+            redraw = True
             while True:
-                # Clear line and show current input
-                sys.stdout.write('\r')
-                sys.stdout.write('\033[K')  # Clear to end of line
-                sys.stdout.write(input_text)
-                # Move cursor to position
-                sys.stdout.write('\r')
-                if position > 0:
-                    sys.stdout.write(f'\033[{position}C')
-                sys.stdout.flush()
-
-                char = self.get_char()
-
-                if ord(char) == 27:  # ESC
-                    char2 = self.get_char()
-                    if char2 == '[':
-                        char3 = self.get_char()
-                        if char3 == 'D':  # Left arrow
-                            position = max(0, position - 1)
-                        elif char3 == 'C':  # Right arrow
-                            position = min(len(input_text), position + 1)
-                        elif char3 == 'H':  # Home
-                            position = 0
-                        elif char3 == 'F':  # End
-                            position = len(input_text)
-                        elif char3 == '3':  # Delete
-                            self.get_char()  # Read the trailing ~
-                            if position < len(input_text):
-                                input_text = input_text[:position] + input_text[position+1:]
-                    else:
-                        print("\nCancelled.")
-                        return 0
-
-                elif ord(char) == 13:  # Enter
+                if redraw:
+                    # Clear line, show current input and move cursor to position
+                    out = CLEAR_LINE + input_text.encode('utf-8') + b'\r'
+                    if position > 0:
+                        out += f'\033[{position}C'.encode()
+                    redraw = False
+                if out:
+                    os.write(out_fd, out)
+                    out = b''
+
+                key = self.read_key(fd)
+
+                # Only emit the terminal changes for the edit, redraw for mid-line inserts
+                if key == b'\x1b[D':  # Left arrow
+                    if position > 0:
+                        position -= 1
+                        out = CURSOR_LEFT
+                elif key == b'\x1b[C':  # Right arrow
+                    if position < len(input_text):
+                        position += 1
+                        out = CURSOR_RIGHT
+                elif key == b'\x1b[H':  # Home
+                    position = 0
+                    out = b'\r'
+                elif key == b'\x1b[F':  # End
+                    position = len(input_text)
+                    redraw = True
+                elif key == b'\x1b[3~':  # Delete
+                    if position < len(input_text):
+                        input_text = input_text[:position] + input_text[position+1:]
+                        out = DELETE_CHAR
+                elif key.startswith(b'\x1b['):  # Other escape sequences
+                    pass
+                elif key.startswith(b'\x1b'):  # ESC
+                    cancelled = True
                     break
 
-                elif ord(char) in (127, 8):  # Backspace
+                elif key == b'\r':  # Enter
+                    break
+
+                elif key in (b'\x7f', b'\x08'):  # Backspace
                     if position > 0:
                         input_text = input_text[:position-1] + input_text[position:]
                         position -= 1
+                        out = CURSOR_LEFT + DELETE_CHAR
 
-                elif ord(char) >= 32:  # Printable characters
-                    input_text = input_text[:position] + char + input_text[position:]
-                    position += 1
+                else:  # Printable characters
+                    char = chr(key[0]) if key[0] < 0x80 else key.decode('utf-8', 'ignore')
+                    if char and char.isprintable():
+                        if position == len(input_text):
+                            out = char.encode('utf-8')
+                        else:
+                            redraw = True
+                        input_text = input_text[:position] + char + input_text[position:]
+                        position += len(char)
 
         finally:
             termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
 
+        if cancelled:
+            print("\nCancelled.")
+            return 0
+
         print()
         if not input_text:
             input_text = command
@@ -236,10 +451,12 @@ class AI:
         env = os.environ.copy()
         env['TERM'] = 'xterm-256color'
 
-        # Escape the entire command for shell execution
+        # Replace this process with bash, nothing runs after the command
+        sys.stdout.flush()
+        self.close_connections()
         try:
-            return subprocess.call(['bash', '-c', input_text], env=env)
-        except subprocess.CalledProcessError as e:
+            os.execvpe('bash', ['bash', '-c', input_text], env)
+        except OSError as e:
             print(f"Command execution failed: {e}")
             return 1
 
@@ -247,8 +464,11 @@ def main():
     try:
         ai = AI()
         args = sys.argv[1:]
+        if '--no-cache' in args:
+            ai.use_cache = False
+            args = [arg for arg in args if arg != '--no-cache']
         if not args:
-            print("Usage: ai <your command description>")
+            print("Usage: ai [--no-cache] <your command description>")
             sys.exit(1)
         sys.exit(ai.run(args))
     except Exception as e: